@@ -22,115 +22,229 @@ import os
 import platform
 import re
 import shutil
+import stat
 import subprocess
 import sys
 import time
 
+# Upper bound on how long to wait for the kernel counters to move after hdparm exits
+STAT_UPDATE_TIMEOUT = 5.0
+STAT_POLL_INTERVAL = 0.05
+
+# Disk names are restricted to ASCII alphanumerics; \Z also rejects a trailing newline
+_DISK_NAME_RE = re.compile(r'^[a-zA-Z0-9]+\Z')
+
+
+def _parse_diskstat(stat_line):
+    """
+    Parse the leading counters of a disk stat line.
+
+    The first three counters are reads completed, reads merged and sectors
+    read (see Documentation/block/stat.rst), which are enough to tell whether
+    any I/O happened.
+
+    Args:
+        stat_line (bytes): A /sys/block/<disk>/stat line, or the counter
+            fields of a /proc/diskstats line.
+
+    Returns:
+        tuple: The first three counters as ints, or None if the line is empty
+        or malformed.
+    """
+    # Stop splitting after the fields we need; the stat line has 11-17 of them
+    fields = stat_line.split(None, 3)[:3]
+    if len(fields) < 3:
+        return None
+    try:
+        return tuple(int(x) for x in fields)
+    except ValueError:
+        return None
+
+
+def _read_file(path):
+    """
+    Read a small procfs/sysfs file without going through a buffered file object.
+
+    Args:
+        path (str): The file to read.
+
+    Returns:
+        bytes: The file contents, or None if it could not be read.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        chunks = []
+        while True:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b"".join(chunks)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+
 
 class DiskStatsTest:
+    # Host checks that cannot change during the process lifetime, shared
+    # by all instances once done
+    _preflight_done = False
+    _hdparm_path = None
+
     def __init__(self, disk="sda", verbose=False):
         self.disk = disk
         self.verbose = verbose
         self.logger = logging.getLogger(__name__)
         self.sys_stat_path = f"/sys/block/{self.disk}/stat"
 
-    def validate_disk_name(self):
-        """
-        Validate the disk name to prevent injection attacks.
+    @classmethod
+    def _preflight(cls, disk):
         """
-        if not re.match(r'^[a-zA-Z0-9]+$', self.disk):
-            self.logger.error(f"Invalid disk name '{self.disk}'.")
-            sys.exit(1)
+        Run the startup checks: Linux host, root privileges and a valid disk name.
 
-    def check_compatibility(self):
-        """
-        Ensure the script is running on a Linux system.
-        """
-        if platform.system() != "Linux":
-            self.logger.error("This script is only compatible with Linux.")
-            sys.exit(1)
-    
-    def check_permissions(self):
-        """
-        Ensure the script is run with root permissions.
+        The host checks cannot change during the process lifetime, so they run
+        once and the result is cached on the class. The disk name is validated
+        on every call to prevent injection attacks. hdparm is checked
+        separately, only once it is needed.
+
+        Args:
+            disk (str): The disk device name to validate.
         """
-        if os.geteuid() != 0:
-            self.logger.error("This script requires root privileges. Please run as root or use sudo.")
+        logger = logging.getLogger(__name__)
+        if not cls._preflight_done:
+            if platform.system() != "Linux":
+                logger.error("This script is only compatible with Linux.")
+                sys.exit(1)
+            if os.geteuid() != 0:
+                logger.error("This script requires root privileges. Please run as root or use sudo.")
+                sys.exit(1)
+            cls._preflight_done = True
+
+        if not _DISK_NAME_RE.match(disk):
+            logger.error(f"Invalid disk name '{disk}'.")
             sys.exit(1)
 
     def check_hdparm(self):
         """
         Verify that 'hdparm' is installed, as it is required for disk activity.
+        The lookup result is cached on the class.
         """
-        if shutil.which("hdparm") is None:
+        if DiskStatsTest._hdparm_path is None:
+            DiskStatsTest._hdparm_path = shutil.which("hdparm")
+        if DiskStatsTest._hdparm_path is None:
             self.logger.error("'hdparm' is not installed. Please install it using 'sudo apt-get install hdparm'.")
             sys.exit(1)
 
-    def disk_check(self, command, message):
+    def _in_partitions(self, data):
         """
-        Check if a certain command related to the disk passes.
-        
+        Check whether the disk is listed in /proc/partitions.
+
+        Only the name column is compared, after skipping the header line and
+        the blank line that follows it.
+
         Args:
-            command (list): The command to execute as a list of arguments.
-            message (str): The error message to display if the command fails.
+            data (bytes): The contents of /proc/partitions.
 
         Returns:
-            bool: True if the command succeeds, False otherwise.
-        """
-        result = subprocess.run(command, capture_output=True, text=True)
-        if result.returncode != 0:
-            self.logger.error(message)
-            if result.stdout:
-                self.logger.debug(f"stdout: {result.stdout.strip()}")
-            if result.stderr:
-                self.logger.debug(f"stderr: {result.stderr.strip()}")
+            bool: True if the disk is listed, False otherwise.
+        """
+        if data is None:
             return False
-        return True
+        name = [self.disk.encode()]
+        return any(line.split()[-1:] == name for line in data.splitlines()[2:])
 
-    def capture_stats(self):
+    def _capture_sys(self):
         """
-        Capture the baseline stats for the disk from /proc/diskstats and /sys/block/<disk>/stat.
-        
+        Capture the stats for the disk from /sys/block/<disk>/stat.
+
         Returns:
-            tuple: proc_stat (str), sys_stat (str)
-        """
-        # Capture /proc/diskstats
-        result = subprocess.run(
-            ["grep", "-w", "-m", "1", self.disk, "/proc/diskstats"],
-            capture_output=True, text=True
-        )
-        proc_stat = result.stdout.strip()
-        
-        # Capture /sys/block/<disk>/stat
-        sys_stat = ""
-        if os.path.isfile(self.sys_stat_path):
-            with open(self.sys_stat_path, 'r') as f:
-                sys_stat = f.read().strip()
-        
-        return proc_stat, sys_stat
+            bytes: sys_stat
+        """
+        try:
+            fd = os.open(self.sys_stat_path, os.O_RDONLY)
+        except OSError:
+            return b""
+        try:
+            # The stat file is well under a page, so one read gets all of it
+            return os.read(fd, 4096).strip()
+        except OSError:
+            return b""
+        finally:
+            os.close(fd)
+
+    def _capture_proc(self):
+        """
+        Capture the stats for the disk from /proc/diskstats.
+
+        Only used when the final read of /sys/block/<disk>/stat is empty or
+        cannot be parsed, so the whole-device scan stays off the common path.
+
+        Returns:
+            bytes: The counter fields of the disk's line, or b"" if it is not listed.
+        """
+        name = self.disk.encode()
+        for line in (_read_file("/proc/diskstats") or b"").splitlines():
+            fields = line.split(None, 3)
+            if len(fields) == 4 and fields[2] == name:
+                return fields[3].strip()
+        return b""
 
     def generate_disk_activity(self):
         """
-        Generate disk activity using hdparm to measure disk read performance.
+        Start hdparm in the background to generate disk read activity.
+
+        Returns:
+            subprocess.Popen: The running hdparm process.
+        """
+        self.check_hdparm()
+        # The benchmark output is not used, so only stderr is kept for diagnostics.
+        # An absolute executable path and close_fds=False let subprocess use
+        # posix_spawn instead of fork+exec; our own fds are non-inheritable anyway.
+        return subprocess.Popen([DiskStatsTest._hdparm_path, "-t", f"/dev/{self.disk}"],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                close_fds=False)
+
+    def wait_for_stats_update(self, proc, counters_begin):
+        """
+        Wait for hdparm to exit, then poll /sys/block/<disk>/stat.
+
+        Polling stops as soon as the counters differ from the baseline, or
+        after STAT_UPDATE_TIMEOUT seconds if they never change. Nothing is
+        read while hdparm runs, so the poll does not add sysfs traffic to
+        the benchmark.
+
+        Args:
+            proc (subprocess.Popen): The hdparm process from generate_disk_activity.
+            counters_begin (tuple): The baseline counters from _parse_diskstat.
+
+        Returns:
+            bytes: The last stat line read.
         """
-        result = subprocess.run(["hdparm", "-t", f"/dev/{self.disk}"], capture_output=True, text=True)
-        if result.returncode != 0:
+        _, stderr = proc.communicate()
+        if proc.returncode != 0:
             self.logger.error("Failed to generate disk activity")
-            if result.stdout:
-                self.logger.debug(f"stdout: {result.stdout.strip()}")
-            if result.stderr:
-                self.logger.debug(f"stderr: {result.stderr.strip()}")
+            if stderr:
+                self.logger.debug(f"stderr: {stderr.decode(errors='replace').strip()}")
             sys.exit(1)
 
+        deadline = time.monotonic() + STAT_UPDATE_TIMEOUT
+        while True:
+            sys_stat = self._capture_sys()
+            counters = _parse_diskstat(sys_stat)
+            if (counters is not None and counters != counters_begin) or time.monotonic() >= deadline:
+                return sys_stat
+            time.sleep(STAT_POLL_INTERVAL)
+
     def test_disk_stats(self):
         """
         Perform the sequence of checks and validation to test the disk statistics.
         """
-        # Check system compatibility and hdparm availability
-        self.check_compatibility()
-        self.check_permissions()
-        self.validate_disk_name()
-        self.check_hdparm()
+        # Check system compatibility; hdparm is checked only once it is needed
+        self._preflight(self.disk)
 
         # Check if the disk is an NVDIMM
         if "pmem" in self.disk:
@@ -138,49 +252,62 @@ class DiskStatsTest:
             sys.exit(0)
         
         # Check if the disk exists in various system locations
-        if not self.disk_check(["grep", "-w", self.disk, "/proc/partitions"],
-                               f"Disk {self.disk} not found in /proc/partitions"):
-            sys.exit(1)
-
-        if not self.disk_check(["grep", "-w", "-m", "1", self.disk, "/proc/diskstats"],
-                               f"Disk {self.disk} not found in /proc/diskstats"):
+        if not self._in_partitions(_read_file("/proc/partitions")):
+            self.logger.error(f"Disk {self.disk} not found in /proc/partitions")
             sys.exit(1)
 
-        if not os.path.exists(f"/sys/block/{self.disk}"):
+        # Match the disk by directory entry name, which needs no stat() per path
+        try:
+            with os.scandir("/sys/block") as it:
+                entry = next((e for e in it if e.name == self.disk), None)
+        except OSError:
+            entry = None
+        if entry is None:
             self.logger.error(f"Disk {self.disk} not found in /sys/block")
             sys.exit(1)
 
-        if not os.path.isfile(self.sys_stat_path) or os.path.getsize(self.sys_stat_path) == 0:
+        # A single stat() covers existence, file type and size
+        try:
+            st = os.stat(os.path.join(entry.path, "stat"))
+        except OSError:
+            st = None
+
+        if st is None or not stat.S_ISREG(st.st_mode) or st.st_size == 0:
             self.logger.error(f"stat is either empty or nonexistent in /sys/block/{self.disk}/")
             sys.exit(1)
 
         # Capture initial stats
-        proc_stat_begin, sys_stat_begin = self.capture_stats()
-        self.logger.debug(f"Initial /proc/diskstats: {proc_stat_begin}")
-        self.logger.debug(f"Initial /sys/block/{self.disk}/stat: {sys_stat_begin}")
-
-        # Generate disk activity
-        self.generate_disk_activity()
-
-        # Wait 5 seconds to allow stat files to update
-        time.sleep(5)
-
-        # Capture stats again
-        proc_stat_end, sys_stat_end = self.capture_stats()
-        self.logger.debug(f"Final /proc/diskstats: {proc_stat_end}")
-        self.logger.debug(f"Final /sys/block/{self.disk}/stat: {sys_stat_end}")
-
-        # Check if stats have changed
-        if proc_stat_begin == proc_stat_end:
-            self.logger.error("Stats in /proc/diskstats did not change")
-            self.logger.debug(f"Before: {proc_stat_begin}")
-            self.logger.debug(f"After: {proc_stat_end}")
+        sys_stat_begin = self._capture_sys()
+        self.logger.debug(f"Initial /sys/block/{self.disk}/stat: {sys_stat_begin.decode()}")
+
+        counters_begin = _parse_diskstat(sys_stat_begin)
+        if counters_begin is None:
+            self.logger.error(f"Unable to read stats from /sys/block/{self.disk}/stat")
             sys.exit(1)
 
-        if sys_stat_begin == sys_stat_end:
+        # Generate disk activity and capture stats again as soon as they move
+        proc = self.generate_disk_activity()
+        sys_stat_end = self.wait_for_stats_update(proc, counters_begin)
+        self.logger.debug(f"Final /sys/block/{self.disk}/stat: {sys_stat_end.decode()}")
+
+        # Check if stats have changed. If the final sysfs read is unusable,
+        # fall back to /proc/diskstats, which reports the same kernel counters.
+        # A read that cannot be parsed never counts as a change.
+        counters_end = _parse_diskstat(sys_stat_end)
+        if counters_end is None:
+            proc_stat = self._capture_proc()
+            self.logger.debug(f"Final /proc/diskstats: {proc_stat.decode()}")
+            counters_proc = _parse_diskstat(proc_stat)
+            if counters_proc is None or counters_proc == counters_begin:
+                self.logger.error(f"Stats in /sys/block/{self.disk}/stat and /proc/diskstats did not change")
+                self.logger.debug(f"Before: {sys_stat_begin.decode()}")
+                self.logger.debug(f"After (/sys/block/{self.disk}/stat): {sys_stat_end.decode()}")
+                self.logger.debug(f"After (/proc/diskstats): {proc_stat.decode()}")
+                sys.exit(1)
+        elif counters_end == counters_begin:
             self.logger.error(f"Stats in /sys/block/{self.disk}/stat did not change")
-            self.logger.debug(f"Before: {sys_stat_begin}")
-            self.logger.debug(f"After: {sys_stat_end}")
+            self.logger.debug(f"Before: {sys_stat_begin.decode()}")
+            self.logger.debug(f"After: {sys_stat_end.decode()}")
             sys.exit(1)
 
         # Final status message